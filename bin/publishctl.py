@@ -1,150 +1,522 @@
 #!/usr/bin/env python3
 
 from __future__ import annotations
-import os, sys, subprocess, json, time
+import os, sys, argparse, io, re, stat, shlex, shutil, subprocess, threading, json, time, copy, itertools, atexit, hashlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import typer, yaml, jinja2, requests
-
-app = typer.Typer()
+import yaml, jinja2, requests
+from requests.adapters import HTTPAdapter
+try:
+    from yaml import CSafeLoader as _Loader # libyaml, much faster when available
+except ImportError:
+    from yaml import SafeLoader as _Loader
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 BASE = Path('/opt/publisher')
 TPL = BASE / 'templates'
 APACHE_SITES = Path('/etc/apache2/sites-available')
+APACHE_ENABLED = Path('/etc/apache2/sites-enabled')
 STATE = BASE / 'var/state.json'
+JINJA_CACHE = BASE / 'var/jinja_cache'
+
+# shared so repeated healthchecks reuse pooled keep-alive connections
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=16))
+_SESSION.mount('http://', HTTPAdapter(pool_connections=8, pool_maxsize=16))
+
+# preinstall commands containing any of these need a real shell
+_SHELL_META = re.compile(r'[|&;<>$`*?(){}\[\]~#\n\r]')
+_SHELL_BUILTINS = frozenset(('source', '.', 'export', 'cd', 'alias', 'set', 'unset', 'eval', 'exec', 'ulimit', 'umask'))
 
 class Sh:
     @staticmethod
-    def run(cmd: list[str], check=True, capture=False):
-        """Run a shell command."""
+    def run(cmd: list[str], check=True, capture=False, cwd=None):
+        """Run a shell command.
+
+        With capture=True output is still streamed live, and also collected
+        into the result's stdout/stderr.
+        """
         print('+', ' '.join(cmd))
-        return subprocess.run(cmd, check=check, capture_output=capture, text=True)
+        if not capture:
+            return subprocess.run(cmd, check=check, text=True, cwd=cwd)
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             text=True, errors='replace', bufsize=1, cwd=cwd)
+        out, err = io.StringIO(), io.StringIO()
+        readers = [
+            threading.Thread(target=Sh._tee, args=(p.stdout, sys.stdout, out)),
+            threading.Thread(target=Sh._tee, args=(p.stderr, sys.stderr, err)),
+        ]
+        for t in readers:
+            t.start()
+        for t in readers:
+            t.join()
+        rc = p.wait()
+        result = subprocess.CompletedProcess(cmd, rc, out.getvalue(), err.getvalue())
+        if check:
+            result.check_returncode()
+        return result
+
+    @staticmethod
+    def _tee(src, live, buf: io.StringIO):
+        """Copy lines from a pipe to both a live stream and a buffer."""
+        with src:
+            for line in src:
+                live.write(line)
+                live.flush()
+                buf.write(line)
+
+    @staticmethod
+    def run_batch(cmds: list[list[str]], check=True):
+        """Run independent commands concurrently and wait for all of them."""
+        procs = []
+        for cmd in cmds:
+            print('+', ' '.join(cmd))
+            procs.append(subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True))
+        results = []
+        for cmd, p in zip(cmds, procs):
+            out, err = p.communicate()
+            sys.stdout.write(out)
+            sys.stderr.write(err)
+            results.append(subprocess.CompletedProcess(cmd, p.returncode, out, err))
+        if check:
+            for r in results:
+                r.check_returncode()
+        return results
+
+    @staticmethod
+    def run_stages(*plans: list[list[list[str]]]):
+        """Run several staged command plans, batching the same stage of every plan together.
+
+        Identical commands within a stage (e.g. daemon-reload) run only once.
+        """
+        for stage in itertools.zip_longest(*plans, fillvalue=[]):
+            cmds = list({tuple(cmd): cmd for cmds in stage for cmd in cmds}.values())
+            if cmds:
+                Sh.run_batch(cmds)
+
+def _bytecode_cache() -> jinja2.BytecodeCache | None:
+    """Return an on-disk bytecode cache, or None if its directory can't be created."""
+    try:
+        JINJA_CACHE.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+    return jinja2.FileSystemBytecodeCache(directory=str(JINJA_CACHE))
+
+# shared across calls so compiled templates stay in jinja's cache; the bytecode
+# cache carries them over to the next publishctl process
+_ENV = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(str(TPL)),
+    bytecode_cache=_bytecode_cache(),
+    auto_reload=False,
+    cache_size=400,
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
 
 def render(template_rel: str, ctx: dict) -> str:
     """Render a jinja2 template from the TPL directory."""
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(TPL))
-    tpl = env.get_template(template_rel)
-    return tpl.render(**ctx)
+    return _ENV.get_template(template_rel).render(**ctx)
+
+def write_file(path: Path, content: str | bytes, mode=0o644) -> bool:
+    """Write content to a file atomically and durably, creating parent directories as needed.
+
+    str content is encoded to UTF-8 once; bytes are written as-is.
 
-def write_file(path: Path, content: str, mode=0o644):
-    """Write content to a file atomically, creating parent directories as needed."""
+    Returns False (and leaves the file alone) when it already has this content and mode.
+    """
+    data = content.encode() if isinstance(content, str) else content
+    try:
+        if path.read_bytes() == data and stat.S_IMODE(path.stat().st_mode) == mode:
+            return False
+    except FileNotFoundError:
+        pass
     path.parent.mkdir(parents=True, exist_ok=True)
     tmp = path.with_suffix(path.suffix + '.tmp')
-    tmp.write_text(content)
-    os.chmod(tmp, mode)
-    tmp.replace(path)
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        os.fchmod(fd, mode) # os.open's mode is masked by umask and ignored for existing files
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, path)
+    # fsync the directory so the rename itself survives a crash
+    dfd = os.open(path.parent, os.O_RDONLY)
+    try:
+        os.fsync(dfd)
+    finally:
+        os.close(dfd)
+    return True
+
+def _section(m: dict, key: str) -> dict:
+    """Return m[key] as a dict, replacing a missing or empty section with {}."""
+    m[key] = m.get(key) or {}
+    return m[key]
+
+def _normalize(m: dict, manifest_path: Path) -> dict:
+    """Check required keys and fill in defaults once, so callers can index directly."""
+    missing = [k for k in ('name', 'kind', 'fqdn') if k not in m]
+    if missing:
+        raise ValueError(f"{manifest_path}: missing required keys: {', '.join(missing)}")
+    backend = _section(m, 'backend')
+    backend.setdefault('host', '127.0.0.1')
+    backend.setdefault('port', 8000)
+    backend.setdefault('working_dir', f"/srv/{m['name']}")
+    entrypoint = _section(backend, 'entrypoint')
+    for key in ('module', 'extra_args', 'venv', 'cmd'):
+        entrypoint.setdefault(key, '')
+    if 'apache' in m:
+        apache = _section(m, 'apache')
+        if 'template' not in apache:
+            raise ValueError(f"{manifest_path}: missing required keys: apache.template")
+        apache.setdefault('log_prefix', m['name'])
+    if 'flutter' in m:
+        _section(m, 'flutter').setdefault('document_root', '/var/www/html')
+    if 'scm' in m and 'repo' not in _section(m, 'scm'):
+        raise ValueError(f"{manifest_path}: missing required keys: scm.repo")
+    _section(m, 'deploy').setdefault('preinstall', [])
+    _section(m, 'healthcheck')
+    return m
+
+# path -> (st_mtime_ns, st_size, parsed manifest)
+_manifest_cache: dict[Path, tuple[int, int, dict]] = {}
 
 def load_manifest(manifest_path: Path) -> dict:
-    """Load a YAML manifest file and return its contents as a dictionary."""
-    data = yaml.safe_load(manifest_path.read_text())
+    """Load a YAML manifest file and return its contents as a dictionary.
+
+    Parsed manifests are memoized by path, mtime and size; callers get a copy
+    so they are free to mutate it.
+    """
+    st = manifest_path.stat()
+    cached = _manifest_cache.get(manifest_path)
+    if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+        data = copy.deepcopy(cached[2])
+    else:
+        # libyaml decodes bytes in C, skipping a Python-level decode
+        parsed = _normalize(yaml.load(manifest_path.read_bytes(), Loader=_Loader), manifest_path)
+        _manifest_cache[manifest_path] = (st.st_mtime_ns, st.st_size, parsed)
+        data = copy.deepcopy(parsed)
     data['__manifest_path'] = str(manifest_path)
     return data
 
+# apply-many runs docker_apply from several threads against the same state file
+_state_lock = threading.Lock()
+
+def load_state() -> dict:
+    """Load the registry of applied apps, or an empty one if it doesn't exist yet."""
+    try:
+        raw = STATE.read_bytes()
+    except FileNotFoundError:
+        return {}
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+def save_state(state: dict):
+    """Persist the registry of applied apps."""
+    if orjson:
+        write_file(STATE, orjson.dumps(state, option=orjson.OPT_INDENT_2))
+    else:
+        write_file(STATE, json.dumps(state, indent=2))
+
 def ensure_ssl(fqdn: str):
     Sh.run(['sudo', 'certbot', '--apache', '-n', '--agree-tos', '-m', 'admin@' + fqdn.split('.',1)[-1], '-d', fqdn, '--redirect'])
 
-def apache_apply(m: dict):
-    """Render and apply an Apache virtual host configuration, then enable the site and reload Apache."""
+# set when a vhost changed; reload_apache() turns any number of those into one reload
+_apache_dirty = False
+
+def reload_apache():
+    """Reload Apache once if any vhost changed since the last reload."""
+    global _apache_dirty
+    if _apache_dirty:
+        _apache_dirty = False
+        Sh.run(['sudo', 'systemctl', 'reload', 'apache2'])
+
+# don't leave written vhosts unloaded if a command bails out before reloading
+atexit.register(reload_apache)
+
+def apache_apply(m: dict) -> list[list[list[str]]]:
+    """Render and write an Apache virtual host configuration.
+
+    Returns the staged commands that enable the site, and marks Apache for a
+    reload (see reload_apache) when the vhost changed or was newly enabled.
+    """
+    global _apache_dirty
     vhost = render(f"apache/{m['apache']['template']}", {
         'fqdn': m['fqdn'],
-        'backend_host': m.get('backend', {}).get('host', '127.0.0.1'),
-        'backend_port': m.get('backend', {}).get('port', 8000),
-        'docroot': m.get('flutter', {}).get('document_root', '/var/www/html'),
-        'log_prefix': m['apache'].get('log_prefix', m['name'])
+        'backend_host': m['backend']['host'],
+        'backend_port': m['backend']['port'],
+        'docroot': m['flutter']['document_root'] if 'flutter' in m else '/var/www/html',
+        'log_prefix': m['apache']['log_prefix'],
     })
-    vhost_path = APACHE_SITES / f"{m['fqdn']}.conf"
-    write_file(vhost_path, vhost)
-    Sh.run(['sudo', 'a2ensite', f"{m['fqdn']}.conf"]) # idempotent
-    Sh.run(['sudo', 'service', 'apache2', 'reload'])
+    site = f"{m['fqdn']}.conf"
+    changed = write_file(APACHE_SITES / site, vhost)
+    enabled = (APACHE_ENABLED / site).exists()
+    if changed or not enabled:
+        _apache_dirty = True
+    return [
+        [] if enabled else [['sudo', 'a2ensite', site]],
+    ]
+
+def systemd_apply(m: dict) -> list[list[list[str]]]:
+    """Render and write a systemd service file.
 
-def systemd_apply(m: dict):
-    """Render and apply a systemd service file, then enable and start the service."""
+    Returns the staged commands that reload systemd and enable/start the service,
+    leaving out whatever is already in place.
+    """
     template = m['service']['template']
     svc_name = m['name'] + '.service'
+    backend, entrypoint = m['backend'], m['backend']['entrypoint']
     unit = render(f'systemd/{template}', {
         'user': m['service']['user'],
         'group': m['service']['group'],
-        'workdir': m['backend']['working_dir'],
-        'uvicorn_module': m.get('backend', {}).get('entrypoint', {}).get('module', ''),
-        'uvicorn_args': m.get('backend', {}).get('entrypoint', {}).get('extra_args', ''),
-        'venv': m.get('backend', {}).get('entrypoint', {}).get('venv', ''),
-        'cmd': m.get('backend', {}).get('entrypoint', {}).get('cmd', ''),
-        'port': m.get('backend', {}).get('port', 8000),
+        'workdir': backend['working_dir'],
+        'uvicorn_module': entrypoint['module'],
+        'uvicorn_args': entrypoint['extra_args'],
+        'venv': entrypoint['venv'],
+        'cmd': entrypoint['cmd'],
+        'port': backend['port'],
     })
-    write_file(Path('/etc/systemd/system') / svc_name, unit, 0o644)
-    Sh.run(['sudo', 'systemctl', 'daemon-reload'])
-    Sh.run(['sudo', 'systemctl', 'enable', '--now', svc_name])
-
-def docker_apply(m: dict):
-    """Render and apply a docker-compose file, then bring up the stack."""
-    compose = render('docker/docker-compose.j2', m)
-    write_file(Path(m['docker']['compose_path']), compose)
-    Sh.run(['sudo', 'docker', 'compose', '-f', m['docker']['compose_path'], '-p', m['docker']['project'], 'up', '-d'])
-
-def deploy_code(m: dict):
-    """Clone or update the code repository and run preinstall commands."""
-    wd = Path(m['backend']['working_dir']) if 'backend' in m else Path('/srv')/m['name']
+    changed = write_file(Path('/etc/systemd/system') / svc_name, unit, 0o644)
+    # also catches a unit written by an earlier run that failed before reloading
+    stale = subprocess.run(['systemctl', 'show', '-p', 'NeedDaemonReload', '--value', svc_name],
+                           capture_output=True, text=True).stdout.strip() == 'yes'
+    running = (subprocess.call(['systemctl', 'is-enabled', '--quiet', svc_name]) == 0
+               and subprocess.call(['systemctl', 'is-active', '--quiet', svc_name]) == 0)
+    return [
+        [['sudo', 'systemctl', 'daemon-reload']] if changed or stale else [],
+        [] if running else [['sudo', 'systemctl', 'enable', '--now', svc_name]],
+    ]
+
+def _compose_containers(out: str) -> list[dict]:
+    """Parse `docker compose ps --format json`, which is a JSON array or one object per line depending on version."""
+    out = out.strip()
+    if not out:
+        return []
+    if out.startswith('['):
+        return json.loads(out)
+    return [json.loads(line) for line in out.splitlines() if line.strip()]
+
+def _compose_digest(dc: list[str]) -> tuple[str, set[str]]:
+    """Hash the resolved compose config (env_file values inlined) and the local image ids.
+
+    Returns the digest and the stack's service names, both from one `compose config` call.
+    """
+    # not Sh.run: the resolved config contains .env secrets, keep it out of the logs
+    raw = subprocess.run(dc + ['config', '--format', 'json'], capture_output=True, check=True).stdout
+    config = json.loads(raw)
+    services = config.get('services') or {}
+    # build-only services get compose's default image name
+    images = [svc.get('image') or f"{config['name']}-{name}" for name, svc in services.items()]
+    ids = subprocess.run(['sudo', 'docker', 'image', 'inspect', '--format', '{{.Id}}', *images],
+                         capture_output=True).stdout if images else b''
+    return hashlib.blake2b(raw + ids, digest_size=16).hexdigest(), set(services)
+
+def docker_apply(m: dict, moved=False):
+    """Render and apply a docker-compose file, then bring up the stack.
+
+    `compose up` is skipped when the checkout didn't move, the resolved compose
+    config and images match the hash recorded in STATE, and every service
+    already has a container; stopped ones are started.
+    """
+    write_file(Path(m['docker']['compose_path']), render('docker/docker-compose.j2', m))
+    dc = ['sudo', 'docker', 'compose', '-f', m['docker']['compose_path'], '-p', m['docker']['project']]
+    digest, services = _compose_digest(dc)
+    with _state_lock:
+        entry = load_state().get(m['name'], {})
+    if not moved and entry.get('compose_hash') == digest:
+        containers = _compose_containers(Sh.run(dc + ['ps', '--all', '--format', 'json'], capture=True).stdout)
+        if services - {c['Service'] for c in containers}:
+            Sh.run(dc + ['up', '-d'])
+        elif any(c['State'] != 'running' for c in containers):
+            Sh.run(dc + ['start'])
+        return
+    Sh.run(dc + ['up', '-d'])
+    with _state_lock:
+        state = load_state()
+        state[m['name']] = {**state.get(m['name'], {}), 'compose_hash': digest}
+        save_state(state)
+
+def _exec_argv(cmd: str, wd: Path) -> list[str] | None:
+    """Split a preinstall command for a direct exec, or return None if it needs bash."""
+    if _SHELL_META.search(cmd):
+        return None
+    try:
+        argv = shlex.split(cmd)
+    except ValueError: # unbalanced quotes; let bash report it
+        return None
+    if not argv or re.match(r'\w+=', argv[0]) or argv[0] in _SHELL_BUILTINS:
+        return None
+    prog = argv[0] if os.sep not in argv[0] else str(wd / argv[0])
+    if not shutil.which(prog):
+        return None
+    return argv
+
+def deploy_code(m: dict) -> bool:
+    """Clone or update the code repository and run preinstall commands.
+
+    Returns True when the checkout was cloned or moved to a new commit.
+    """
+    moved = False
+    wd = Path(m['backend']['working_dir'])
     wd.mkdir(parents=True, exist_ok=True)
     if 'scm' in m:
         repo = m['scm']['repo']; branch = m['scm'].get('branch','main')
         if not (wd/'.git').exists():
             Sh.run(['git', 'clone', '--depth=1', '--branch', branch, repo, str(wd)])
-    else:
-        Sh.run(['git', '-C', str(wd), 'fetch', 'origin', branch, '--depth=1'])
-        Sh.run(['git', '-C', str(wd), 'reset', '--hard', f'origin/{branch}'])
-    for cmd in m.get('deploy',{}).get('preinstall', []):
-        Sh.run(['bash','-lc', f"cd {wd} && {cmd}"])
+            moved = True
+        else:
+            # skip fetch+reset when the checkout is already at the remote head
+            remote = Sh.run(['git', 'ls-remote', repo, f'refs/heads/{branch}'], capture=True).stdout.split()
+            local = Sh.run(['git', '-C', str(wd), 'rev-parse', 'HEAD'], capture=True, check=False).stdout.strip()
+            if not remote or remote[0] != local:
+                Sh.run(['git', '-C', str(wd), 'fetch', 'origin', branch, '--depth=1'])
+                Sh.run(['git', '-C', str(wd), 'reset', '--hard', f'origin/{branch}'])
+                moved = True
+    for cmd in m['deploy']['preinstall']:
+        argv = _exec_argv(cmd, wd)
+        if argv:
+            Sh.run(argv, cwd=str(wd))
+        else:
+            Sh.run(['bash', '-c', cmd], cwd=str(wd))
+    return moved
 
 
-@app.command()
-def apply(manifest: Path):
-    """Apply (create/update) an app from manifest."""
-    m = load_manifest(manifest)
-    kind = m['kind']
+KINDS = ('fastapi', 'streamlit', 'flutter', 'docker')
+
+def _check_kind(m: dict):
+    if m['kind'] not in KINDS:
+        print(f"Unsupported kind: {m['kind']}")
+        raise SystemExit(2)
+
+def _apply_manifest(m: dict) -> list[list[list[list[str]]]]:
+    """Deploy code and write config files for one manifest.
 
+    Returns the staged command plans still to run (see Sh.run_stages), so
+    several manifests can share one a2ensite/daemon-reload batch.
+    """
+    kind = m['kind']
     if kind in ('fastapi','streamlit'):
         deploy_code(m)
-        systemd_apply(m)
-        apache_apply(m)
-    elif kind == 'flutter':
+        # systemd and apache are independent: a2ensite runs alongside daemon-reload
+        return [systemd_apply(m), apache_apply(m)]
+    if kind == 'flutter':
         # flutter artifacts should already be present or delivered by CI
-        apache_apply(m)
         docroot = Path(m['flutter']['document_root'])
         docroot.mkdir(parents=True, exist_ok=True)
-    elif kind == 'docker':
-        deploy_code(m)
-        docker_apply(m)
-        # apache reverse proxy to published host:port
-        if 'apache' in m:
-            m.setdefault('backend', {})
-            hp = m['docker']['publish']['http_target']
-            host, port = hp.split(':')
-            m['backend']['host'] = host
-            m['backend']['port'] = int(port)
-            apache_apply(m)
-    else:
-        typer.echo(f"Unsupported kind: {kind}")
-        raise typer.Exit(2)
+        return [apache_apply(m)]
+    # docker
+    docker_apply(m, moved=deploy_code(m))
+    # apache reverse proxy to published host:port
+    if 'apache' in m:
+        hp = m['docker']['publish']['http_target']
+        host, port = hp.split(':')
+        m['backend']['host'] = host
+        m['backend']['port'] = int(port)
+        return [apache_apply(m)]
+    return []
 
+def _finish(m: dict):
+    """Obtain SSL and run the healthcheck once the config is live."""
     if m.get('ssl'):
         ensure_ssl(m['fqdn']) # fqdn = fully qualified domain name
 
     # healthcheck
-    h = m.get('healthcheck',{})
+    h = m['healthcheck']
     if h.get('url'):
         try:
-            r = requests.get(h['url'], timeout=h.get('timeout',5))
-            typer.echo(f"Health: {r.status_code}")
+            print(f"Health: {healthcheck(h['url'], h.get('timeout',5))}")
+        except Exception as e:
+            print(f"Healthcheck failed: {e}")
+
+def apply(manifest: Path):
+    """Apply (create/update) an app from manifest."""
+    m = load_manifest(manifest)
+    _check_kind(m)
+    Sh.run_stages(*_apply_manifest(m))
+    reload_apache() # before certbot and the healthcheck, which need the live config
+    _finish(m)
+
+def apply_many(manifests: list[Path]):
+    """Apply several manifests in parallel, with a single systemd/apache reload."""
+    ms = [load_manifest(p) for p in manifests]
+    for m in ms:
+        _check_kind(m)
+    with ThreadPoolExecutor(max_workers=min(8, len(ms))) as pool:
+        futures = [pool.submit(_apply_manifest, m) for m in ms]
+    # a failing manifest must not drop the staged commands of the ones that were
+    # written, or later runs would see their files unchanged and never enable them
+    done, failed, plans = [], [], []
+    for m, f in zip(ms, futures):
+        try:
+            plans += f.result()
+            done.append(m)
         except Exception as e:
-            typer.echo(f"Healthcheck failed: {e}")
+            failed.append((m, e))
+    Sh.run_stages(*plans)
+    reload_apache()
+    # certbot takes its own lock on the apache config, so these stay sequential
+    for m in done:
+        print(f"\n[{m['name']}]")
+        _finish(m)
+    if failed:
+        for m, e in failed:
+            print(f"\n[{m['name']}] failed: {e!r}")
+        raise SystemExit(1)
+
+def healthcheck(url: str, timeout=5) -> int:
+    """Probe a healthcheck url with HEAD (GET if HEAD isn't allowed) and return the status code."""
+    r = _SESSION.head(url, timeout=timeout, allow_redirects=True)
+    if r.status_code == 405:
+        r = _SESSION.get(url, timeout=timeout)
+    return r.status_code
+
+def _probe(url: str | None, timeout=3) -> int | None:
+    """Probe a healthcheck url and return its status code, or None on failure."""
+    if not url:
+        return None
+    try:
+        return healthcheck(url, timeout)
+    except Exception:
+        return None
+
+def compile_templates():
+    """Precompile all templates into the bytecode cache (run at install time)."""
+    if _ENV.bytecode_cache is None:
+        print(f"Bytecode cache unavailable: cannot create {JINJA_CACHE}")
+        raise SystemExit(1)
+    names = _ENV.list_templates(filter_func=lambda n: n.endswith('.j2'))
+    for name in names:
+        _ENV.get_template(name) # compiling through the env populates the cache
+    print(f"Compiled {len(names)} templates into {JINJA_CACHE}")
 
-@app.command()
 def status(name: str = ''):
     """Show status for all apps or one app."""
-    apps = sorted(Path('/opt/publisher/apps').glob('*.yml'))
-    for path in apps:
-        m = load_manifest(path)
+    with os.scandir(BASE / 'apps') as it:
+        entries = sorted((e for e in it if e.name.endswith('.yml')), key=lambda e: e.name)
+    if name:
+        # manifests are named {name}.yml; fall back to a full scan for ones that aren't
+        entries = [e for e in entries if e.name == f'{name}.yml'] or entries
+    manifests = []
+    for e in entries:
+        m = load_manifest(Path(e.path))
         if name and m['name'] != name:
             continue
+        manifests.append(m)
+    # healthchecks are independent network calls; probe them all at once
+    urls = [m['healthcheck'].get('url') for m in manifests]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        health = list(pool.map(_probe, urls))
+    # one systemctl call reports every unit's state, one line per unit
+    svcs = [m['name'] + '.service' for m in manifests if m['kind'] in ('fastapi','streamlit')]
+    active = {}
+    if svcs:
+        out = subprocess.run(['systemctl', 'is-active', *svcs], capture_output=True, text=True).stdout
+        active = dict(zip(svcs, out.splitlines()))
+    for m, url, code in zip(manifests, urls, health):
         svc = m['name'] + '.service'
         print(f"\n[{m['name']}] {m['fqdn']} ({m['kind']})")
         # apache site enabled?
@@ -152,18 +524,31 @@ def status(name: str = ''):
         print(' apache site:', 'present' if site else 'missing')
         # systemd/docker
         if m['kind'] in ('fastapi','streamlit'):
-            rc = subprocess.call(['systemctl','is-active','--quiet',svc])
-            print(' service:', 'active' if rc==0 else 'inactive')
+            print(' service:', 'active' if active.get(svc) == 'active' else 'inactive')
         if m['kind']=='docker':
             subprocess.call(['docker','ps'])
         # health
-        url = m.get('healthcheck',{}).get('url')
         if url:
-            try:
-                r = requests.get(url, timeout=3)
-                print(' health:', r.status_code)
-            except Exception:
-                print(' health: failed')
+            print(' health:', code if code is not None else 'failed')
+
+def main(argv: list[str] | None = None):
+    """Parse the command line and dispatch to a subcommand."""
+    parser = argparse.ArgumentParser(prog='publishctl')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('apply', help=apply.__doc__)
+    p.add_argument('manifest', type=Path)
+    p.set_defaults(func=apply)
+    p = sub.add_parser('apply-many', help=apply_many.__doc__)
+    p.add_argument('manifests', type=Path, nargs='+')
+    p.set_defaults(func=apply_many)
+    p = sub.add_parser('status', help=status.__doc__)
+    p.add_argument('--name', default='')
+    p.set_defaults(func=status)
+    p = sub.add_parser('compile-templates', help=compile_templates.__doc__)
+    p.set_defaults(func=compile_templates)
+    args = vars(parser.parse_args(argv))
+    func = args.pop('func'); args.pop('cmd')
+    func(**args)
 
 if __name__ == '__main__':
-    app()
+    main()
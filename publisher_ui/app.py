@@ -1,9 +1,27 @@
 import streamlit as st
-import yaml, subprocess, json
+import jinja2, subprocess, json
 from pathlib import Path
 
 
 APPS = Path('/opt/publisher/apps')
+TPL = Path('/opt/publisher/templates')
+
+
+@st.cache_resource
+def _env() -> jinja2.Environment:
+    # cached across reruns so manifest templates are compiled once per server
+    return jinja2.Environment(loader=jinja2.FileSystemLoader(str(TPL)), auto_reload=False, trim_blocks=True, lstrip_blocks=True)
+
+
+@st.cache_data(ttl=5)
+def _list_apps() -> list[Path]:
+    return sorted(APPS.glob('*.yml'))
+
+
+@st.cache_data(ttl=5)
+def _read_manifest(p: str, mtime: float) -> str:
+    # mtime is part of the cache key, so edits invalidate the entry
+    return Path(p).read_text()
 
 
 st.set_page_config(page_title='Publisher', layout='wide')
@@ -12,10 +30,17 @@ st.title('Publisher — Apps')
 
 col1, col2 = st.columns([2,1])
 with col1:
-    files = sorted(APPS.glob('*.yml'))
+    files = _list_apps()
     sel = st.selectbox('Aplicações', files, format_func=lambda p: p.stem)
+    code = None
     if sel:
-        code = sel.read_text()
+        try:
+            code = _read_manifest(str(sel), sel.stat().st_mtime)
+        except FileNotFoundError:
+            # the cached listing can be a few seconds stale
+            _list_apps.clear()
+            st.warning(f'Manifesto removido: {sel}')
+    if code is not None:
         st.code(code, language='yaml')
         if st.button('Apply manifest'):
             r = subprocess.run(['sudo','/opt/publisher/bin/publishctl','apply',str(sel)], capture_output=True, text=True)
@@ -28,24 +53,8 @@ with col2:
     name = st.text_input('Name')
     fqdn = st.text_input('Domain (FQDN)')
     if st.button('Criar manifest'):
-        base = {
-            'name': name, 'kind': kind, 'fqdn': fqdn,
-            'ssl': True,
-            'apache': {'template': f'{kind if kind!="flutter" else "flutter"}.conf.j2', 'http_to_https': True, 'log_prefix': name},
-            'scm': {'repo': 'git@github.com:org/repo.git', 'branch': 'main'}
-        }
-        if kind in ('fastapi','streamlit'):
-            base.update({
-            'backend': {'host':'127.0.0.1','port': 8000 if kind=='fastapi' else 8501,
-            'working_dir': f'/srv/{name}',
-            'entrypoint': {'venv': f'/srv/{name}/.venv', 'module': 'main:app'}},
-            'service': {'template': f'{kind}.service.j2', 'user':'ubuntu','group':'ubuntu'},
-            'deploy': {'strategy': 'native','preinstall': ['python3 -m venv .venv','./.venv/bin/pip install -U pip wheel','./.venv/bin/pip install -r requirements.txt']}
-            })
-        elif kind=='flutter':
-            base.update({'flutter': {'document_root': f'/var/www/{name}', 'artifact_dir': 'build/web'}, 'deploy': {'strategy':'native'}})
-        elif kind=='docker':
-            base.update({'docker': {'compose_path': f'/srv/{name}/docker-compose.yml', 'project': name, 'publish': {'http_target': '127.0.0.1:9000'}}, 'deploy': {'strategy':'docker'}})
+        manifest = _env().get_template(f'manifest/{kind}.yml.j2').render(name=name, fqdn=fqdn)
         out = APPS / f'{name}.yml'
-        out.write_text(yaml.safe_dump(base, sort_keys=False))
+        out.write_text(manifest)
+        _list_apps.clear()
         st.success(f'Manifesto criado: {out}')